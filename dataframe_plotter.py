@@ -1,26 +1,124 @@
 """Functions to assist in making matplotlib and bokeh plots."""
 
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import pandas as pd
 import numpy as np
 
+# http: // matplotlib.org / mpl_examples / color / named_colors.pdf
+_PRIMARY_COLORS = ('b', 'g', 'r', 'c', 'm', 'y', 'black', 'lime', 'orange',
+                   'fuchsia', 'orangered', 'steelblue', 'darkgoldenrod')
+_SECONDARY_COLORS = ('lime', 'orange', 'fuchsia', 'orangered', 'steelblue',
+                     'darkgoldenrod')
+
 
 def datetime_to_hour(date_time):
-    """Convert a datetime object to the fractional hour of the day as a float (03:15pm --> 15.25)"""
-    return date_time.hour + date_time.minute / 60. + date_time.second / 3600. \
-           + date_time.microsecond / (3600. * 1e6)
+    """Convert a datetime object to the fractional hour of the day as a float (03:15pm --> 15.25)
+
+    If **date_time** is a DatetimeIndex or a datetime64 ndarray, the whole
+    array is converted at once and an ndarray of floats is returned, with NaN
+    for NaT.
+    """
+    if isinstance(date_time, (pd.DatetimeIndex, np.ndarray)):
+        if getattr(date_time, 'tz', None) is not None:
+            # Use the local wall time, not UTC
+            date_time = date_time.tz_localize(None)
+        date_time = np.asarray(date_time, dtype='datetime64[us]')
+        hours = (date_time.view('int64') % 86400000000) / 3.6e9
+        hours[np.isnat(date_time)] = np.nan
+        return hours
+    return (((date_time.hour * 60 + date_time.minute) * 60 + date_time.second)
+            * 1000000 + date_time.microsecond) / 3.6e9
 
 
 def intervals_per_day(df_or_series):
     """Returns how many rows per day there are in **df_or_series**"""
-    res = df_or_series.index[1] - df_or_series.index[0]
-    return int((3600 * 24) / res.seconds)
+    values = df_or_series.index.values
+    spacing = values[1] - values[0]
+    if not np.timedelta64(0) < spacing <= np.timedelta64(1, 'D'):
+        raise ValueError('index spacing must be positive and at most one day, '
+                         'got {}'.format(pd.Timedelta(spacing)))
+    return int(np.timedelta64(1, 'D') // spacing)
+
+
+def _minmax_indices(values, max_points):
+    """Returns the positions of the minimum and maximum of **values** in each
+    of about max_points / 2 consecutive buckets, in ascending order. Buckets
+    that are all NaN keep a single NaN so the gap stays visible."""
+    n = len(values)
+    step = int(np.ceil(2. * n / max_points))
+    nb_buckets = n // step
+    buckets = values[:nb_buckets * step].reshape(nb_buckets, step)
+    if np.issubdtype(buckets.dtype, np.floating):
+        missing = np.isnan(buckets)
+        lows = np.where(missing, np.inf, buckets).argmin(axis=1)
+        highs = np.where(missing, -np.inf, buckets).argmax(axis=1)
+        all_missing = missing.all(axis=1)
+    else:
+        lows = buckets.argmin(axis=1)
+        highs = buckets.argmax(axis=1)
+        all_missing = np.zeros(nb_buckets, dtype=bool)
+    offsets = np.arange(nb_buckets) * step
+    indices = np.column_stack((offsets + lows, offsets + highs))
+    indices.sort(axis=1)
+    keep = np.ones(indices.shape, dtype=bool)
+    keep[all_missing, 1] = False
+    return np.concatenate((indices[keep], np.arange(nb_buckets * step, n)))
+
+
+def _decimated(index, values, max_points):
+    """Returns **index** and **values** reduced by _minmax_indices if there are
+    more than **max_points** of them"""
+    if len(values) <= max_points:
+        return index, values
+    keep = _minmax_indices(values, max_points)
+    return index[keep], values[keep]
+
+
+def _series_column(series):
+    """Returns the column name pd.DataFrame(**series**) would have"""
+    return 0 if series.name is None else series.name
+
+
+def _column(df, col):
+    """Returns column **col** of **df**, or **df** itself if it is a Series
+    named **col**"""
+    if isinstance(df, pd.Series):
+        if col != _series_column(df):
+            raise KeyError(col)
+        return df
+    return df[col]
+
+
+def _columns_values(df, cols):
+    """Returns the columns **cols** of **df** as a 2D ndarray"""
+    if isinstance(df, pd.Series):
+        return np.column_stack([_column(df, col).to_numpy() for col in cols])
+    return df[cols].to_numpy()
+
+
+def _plot_line(axis, n, x, y, **kwargs):
+    """Plots the **n**-th line on **axis**, updating the existing line with
+    set_data instead of creating a new one when there is one"""
+    if n < len(axis.lines):
+        line = axis.lines[n]
+        line.set_data(x, y)
+        line.update(kwargs)
+    else:
+        axis.plot(x, y, **kwargs)
+
+
+def _remove_lines(axis, start):
+    """Removes the lines on **axis** from position **start** onwards"""
+    for line in list(axis.lines)[start:]:
+        line.remove()
 
 
 def dataframe_plotter(df, title='', xlabel='', ylabel='', height_per_plot=3,
                       width=12.4, subplots=False, secondary_y=False,
                       secondary_ylabel='', dots=True, plot_type='line',
-                      x_label_rotation=0, linewidth=1):
+                      x_label_rotation=0, linewidth=1, decimate=True,
+                      fig=None, axes=None):
     """Helper function to plot data from a pandas DataFrame or Series
 
     Args:
@@ -52,6 +150,20 @@ def dataframe_plotter(df, title='', xlabel='', ylabel='', height_per_plot=3,
             'bar', make a bar plot. 'average' and 'overlay' require that the index of the DataFrame is a datetimeindex.
         x_label_rotation (int): angle the xlabels will be printed at. 0 --> horizontal,  90 --> verticle.
         linewidth (int): width of the line for line plots.
+        decimate (bool): If True, line plots with more than two points per
+            pixel of **width** only draw the minimum and maximum of each
+            group of points, which preserves the envelope of the data.
+        fig (Figure): Figure returned by a previous call. If given with
+            **axes**, draw on it instead of creating a new figure.
+        axes (tuple): Axes returned by a previous call with the same number
+            of subplots. Lines are updated in place when both calls make line
+            plots, otherwise the axes are cleared and redrawn.
+
+    Returns:
+        tuple: The figure and a tuple of the list of primary axes, the list of
+        secondary axes and **plot_type**, which can be passed back as **fig**
+        and **axes**. Subplots without a secondary axis have None in the
+        secondary list.
 
     Examples:
         >>> import pandas as pd
@@ -65,43 +177,57 @@ periods=len(data), freq='H')
 
         One plot. 'col3' on right yaxis.
 
-        >>> dataframe_plotter(data, title='One plot example', \
+        >>> fig, axes = dataframe_plotter(data, title='One plot example', \
 xlabel='Datetime', ylabel='Fake data', secondary_y='col3', \
 secondary_ylabel='col3')
 
         One subplot for each column.
 
-        >>> dataframe_plotter(data, ylabel=['col1', 'col2', 'col3', 'col4'], \
+        >>> fig, axes = dataframe_plotter(data, ylabel=['col1', 'col2', 'col3', 'col4'], \
 subplots=True)
 
         Two subplots. The first plot has 'col1' and 'col2' on the left side.
         The second plot has 'col3' on the left and 'col4' on the right.
 
-        >>> dataframe_plotter(data, ylabel=['col1 and col2', 'col3'], \
+        >>> fig, axes = dataframe_plotter(data, ylabel=['col1 and col2', 'col3'], \
 subplots=[['col1', 'col2'], ['col3']],secondary_y=[[], ['col4']], \
 secondary_ylabel=['', 'col4'])
 
         Two barplots.
 
-        >>> dataframe_plotter(data, title=['Kittens', 'Puppies'], \
+        >>> fig, axes = dataframe_plotter(data, title=['Kittens', 'Puppies'], \
 subplots=[['col1', 'col3'], ['col2', 'col4']])
 
+        Update the lines of an existing figure with new data.
+
+        >>> fig, axes = dataframe_plotter(data, subplots=True)
+        >>> fig, axes = dataframe_plotter(data * 2, subplots=True, fig=fig, \
+axes=axes)
+
     """
 
-    if type(df) is pd.Series:
-        df = pd.DataFrame(df)
+    if isinstance(df, pd.Series):
+        columns = [_series_column(df)]
+    else:
+        columns = list(df.columns)
 
     if subplots == True:
-        subplots = [[col] for col in df.columns]
+        subplots = [[col] for col in columns]
     elif subplots == False:
-        subplots = [list(df.columns)]
+        subplots = [columns]
+    # Copy so the caller's lists are not modified below
+    subplots = [[cols] if isinstance(cols, str) else list(cols)
+                for cols in subplots]
 
-    if type(secondary_y) is str:
+    if isinstance(secondary_y, str):
         secondary_y = [[secondary_y]]
 
     if secondary_y == False:
         secondary_y = [[]]
 
+    # Any other plot_type falls through to a line plot
+    line_plot = plot_type not in ('overlay', 'average', 'bar')
+
     if dots:
         marker = '.'
     else:
@@ -110,102 +236,156 @@ subplots=[['col1', 'col3'], ['col2', 'col4']])
     nb_plots = len(subplots)
 
     def _str_to_sparse_list(string_or_list, length, list_of_lists=False):
-        sparse_list = [''] * length
-        if type(string_or_list) is str:
+        if isinstance(string_or_list, str):
             string_or_list = [string_or_list]
-        for i in range(len(string_or_list)):
-            if list_of_lists:
-                sparse_list[i] = [string_or_list[i]]
-            else:
-                sparse_list[i] = string_or_list[i]
+        sparse_list = [''] * length
+        for i, item in enumerate(string_or_list[:length]):
+            sparse_list[i] = [item] if list_of_lists else item
         return sparse_list
 
     title = _str_to_sparse_list(title, nb_plots)
     ylabel = _str_to_sparse_list(ylabel, nb_plots)
     secondary_ylabel = _str_to_sparse_list(secondary_ylabel, nb_plots)
 
-    height = height_per_plot * nb_plots
-    f, ax = plt.subplots(nb_plots, sharex=True, figsize=(width, height))
+    if fig is None or axes is None:
+        height = height_per_plot * nb_plots
+        f, ax = plt.subplots(nb_plots, sharex=True, figsize=(width, height))
+        ax = [ax] if nb_plots == 1 else list(ax)
+        ax2 = [None] * nb_plots
+    else:
+        f = fig
+        ax, ax2, previous_plot_type = list(axes[0]), list(axes[1]), axes[2]
+        if len(ax) != nb_plots:
+            raise ValueError('axes has {} subplots but {} are needed'.format(
+                len(ax), nb_plots))
+        # Lines can only be updated in place over a previous line plot
+        if not line_plot or previous_plot_type != plot_type:
+            for i in range(nb_plots):
+                ax[i].cla()
+                if ax2[i] is not None:
+                    # cla() would move a twin's ticks and label to the left
+                    ax2[i].remove()
+                    ax2[i] = None
+
     if nb_plots == 1:
-        ax = [ax]
-        if type(secondary_y[0]) is str:
+        if isinstance(secondary_y[0], str):
             secondary_y = [secondary_y]
         for col2 in secondary_y[0]:
             subplots[0].remove(col2)
     else:
         secondary_y = _str_to_sparse_list(secondary_y, nb_plots)
 
+    max_points = int(2 * f.get_figwidth() * f.dpi) if decimate else len(df)
+    x_index = df.index
+    if getattr(x_index, 'tz', None) is not None:
+        # .values is UTC, plot the local wall time like the DatetimeIndex
+        x_index = x_index.tz_localize(None)
+    x_values = x_index.values
+
     if plot_type == 'bar':
-        df['x_axis'] = np.arange(len(df))
+        x_axis = np.arange(len(df), dtype=np.float64)
 
-    ax2 = [''] * nb_plots
     for i in range(nb_plots):
-        colors = ['b', 'g', 'r', 'c', 'm', 'y', 'black', 'lime', 'orange',
-                  'fuchsia', 'orangered', 'steelblue', 'darkgoldenrod']
         if plot_type == 'bar':
-            ax[i].set_xticks((df['x_axis'] + 0.45).values)
+            ax[i].set_xticks(x_axis + 0.45)
             ax[i].set_xticklabels(list(df.index))
             width = 0.9 / len(subplots[i])
             ax[i].grid(b=True, which='both', axis='y')
         else:
             ax[i].grid(b=True, which='both')
 
-        if type(subplots[i]) == str:
-            subplots[i] = [subplots[i]]
-        for col, f in zip(subplots[i], range(len(subplots[i]))):
+        if plot_type == 'bar':
+            bar_values = _columns_values(df, subplots[i])
+        for k, col in enumerate(subplots[i]):
+            color = _PRIMARY_COLORS[k % len(_PRIMARY_COLORS)]
             if plot_type == 'overlay':
-                overlay_days_plotter(df[col], ax[i], col, colors.pop(0))
+                overlay_days_plotter(_column(df, col), ax[i], col, color)
             elif plot_type == 'average':
-                average_day_plotter(df[col], ax[i], col, colors.pop(0),
+                average_day_plotter(_column(df, col), ax[i], col, color,
                                     marker=marker)
             elif plot_type == 'bar':
-                ax[i].bar(df.x_axis + f * width, df[col], width=width,
-                          label=col, color=colors.pop(0))
+                ax[i].bar(x_axis + k * width, bar_values[:, k], width=width,
+                          label=col, color=color)
             else:
-                ax[i].plot(df.index, df[col], label=col, marker=marker,
+                x, y = _decimated(x_values, _column(df, col).to_numpy(),
+                                  max_points)
+                _plot_line(ax[i], k, x, y, label=col, marker=marker,
                            linewidth=linewidth)
+        if line_plot:
+            _remove_lines(ax[i], len(subplots[i]))
+            ax[i].relim()
+            ax[i].autoscale_view()
 
         if len(secondary_y[i]) > 0:
-            ax2[i] = ax[i].twinx()
-            # http: // matplotlib.org / mpl_examples / color / named_colors.pdf
-            colors = ['lime', 'orange', 'fuchsia', 'orangered', 'steelblue',
-                      'darkgoldenrod']
-            ax2[i].set_prop_cycle(color=colors)
-            if type(secondary_y[i]) == str:
+            if ax2[i] is None:
+                ax2[i] = ax[i].twinx()
+            ax2[i].set_prop_cycle(color=_SECONDARY_COLORS)
+            if isinstance(secondary_y[i], str):
                 secondary_y[i] = [secondary_y[i]]
-            for col2 in secondary_y[i]:
+            if line_plot:
+                secondary_values = _columns_values(df, secondary_y[i])
+            for k, col2 in enumerate(secondary_y[i]):
+                color = _SECONDARY_COLORS[k % len(_SECONDARY_COLORS)]
                 if plot_type == 'overlay':
-                    overlay_days_plotter(df[col2], ax2[i], col2, colors.pop(0))
+                    overlay_days_plotter(_column(df, col2), ax2[i], col2,
+                                         color)
                 elif plot_type == 'average':
-                    average_day_plotter(df[col2], ax2[i], col2,
-                                        colors.pop(0), marker=marker)
+                    average_day_plotter(_column(df, col2), ax2[i], col2, color,
+                                        marker=marker)
                 elif plot_type == 'bar':
                     raise (
                         "secondary y is not supported when plot_type=='bar'")
                 else:
-                    ax2[i].plot(df.index, df[col2], label=col2, marker=marker,
-                                linewidth=linewidth)
+                    x, y = _decimated(x_values, secondary_values[:, k],
+                                      max_points)
+                    _plot_line(ax2[i], k, x, y, label=col2, marker=marker,
+                               linewidth=linewidth)
 
-            handles, labels = ax2[i].get_legend_handles_labels()
-            ax2[i].legend(handles, labels)
             ax2[i].set_ylabel(secondary_ylabel[i], fontsize=13)
             ax2[i].grid(None)
+        elif ax2[i] is not None:
+            ax2[i].remove()
+            ax2[i] = None
+
+        if ax2[i] is not None and line_plot:
+            _remove_lines(ax2[i], len(secondary_y[i]))
+            ax2[i].relim()
+            ax2[i].autoscale_view()
 
         ax[i].set_title(title[i], fontsize=18)
         ax[i].set_ylabel(ylabel[i], fontsize=13)
         handles, labels = ax[i].get_legend_handles_labels()
-        ax[i].legend(handles, labels, loc='upper left')
+        if ax2[i] is not None:
+            # One legend for both axes, drawn on the twin so it sits on top
+            if ax[i].get_legend():
+                ax[i].get_legend().remove()
+            handles2, labels2 = ax2[i].get_legend_handles_labels()
+            ax2[i].legend(handles + handles2, labels + labels2,
+                          loc='upper left')
+        else:
+            ax[i].legend(handles, labels, loc='upper left')
 
     xlabels = ax[-1].get_xticklabels()
     plt.setp(xlabels, rotation=x_label_rotation)
     ax[-1].set_xlabel(xlabel, fontsize=15)
+    return f, (ax, ax2, plot_type)
 
 
 def overlay_days_plotter(series, plot=plt, label=None, color='blue'):
-    dates = [str(d) for d in np.unique(series.index.date)]
-    for date in dates:
-        plot.plot(datetime_to_hour(series.loc[date].index),
-                  series.loc[date].values, color=color, linewidth=0.2)
+    if not series.index.is_monotonic_increasing:
+        series = series.sort_index()
+    index = series.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    days = index.values.astype('datetime64[D]')
+    _, starts = np.unique(days, return_index=True)
+    ends = np.append(starts[1:], len(index))
+    hours = datetime_to_hour(index)
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    segments = [np.column_stack((hours[start:end], values[start:end]))
+                for start, end in zip(starts, ends)]
+    plot.add_collection(LineCollection(segments, colors=color, linewidths=0.2))
+    plot.autoscale_view()
     plot.set_xticks(np.arange(0, 24, 1))
 
     if label:
@@ -213,12 +393,31 @@ def overlay_days_plotter(series, plot=plt, label=None, color='blue'):
     plot.set_xlim([0, 24])
 
 
+def _time_of_day_mean(series):
+    """Returns the fractional hours and the mean of **series** at each
+    distinct time of the day"""
+    hours = datetime_to_hour(series.index)
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    # Sort-based grouping on the exact time of day. Like groupby, rows with
+    # a NaT index are dropped and missing values are skipped.
+    known = ~np.isnan(hours)
+    bin_hours, bins = np.unique(hours[known], return_inverse=True)
+    bins = bins.ravel()
+    values = values[known]
+    valid = ~np.isnan(values)
+    sums = np.bincount(bins[valid], weights=values[valid],
+                       minlength=len(bin_hours))
+    counts = np.bincount(bins[valid], minlength=len(bin_hours))
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    return bin_hours, means
+
+
 def average_day_plotter(series, plot=plt, label=None, color='blue',
                         marker='.'):
-    df = series.to_frame()
-    df['hour'] = datetime_to_hour(series.index)
-    gp = df.groupby('hour').mean()
-    plot.plot(gp.index, gp.values, color=color, label=label, marker=marker)
+    hours, means = _time_of_day_mean(series)
+    plot.plot(hours, means, color=color, label=label, marker=marker)
     plot.set_xticks(np.arange(0, 24, 1))
     plot.set_xlim([0, 24])
 